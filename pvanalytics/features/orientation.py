@@ -1,18 +1,20 @@
 """Functions for identifying system orientation."""
+import functools
+import numpy as np
 import pandas as pd
 from pvanalytics import util
-from pvanalytics.util import _fit, _group
+from pvanalytics.util import _fit
 
 
-def _conditional_fit(day, minutes, fitfunc, freq, default=0.0, min_hours=0.0,
+def _conditional_fit(day, minutes, fitfunc, default=0.0, min_samples=1,
                      peak_min=None):
     # Return the :math:`r^2` of a curve fit to a single day of data if
     # certain conditions are met.
     #
     # `fitfunc` does the curve fitting and is only applied if two
     # conditions are met:
-    # - There must be more than `min_hours` of data in `day`
-    #   (determined by the number of values in `day` times `freq`).
+    # - There must be at least `min_samples` values in `day` (see
+    #   `_min_samples`).
     # - If `peak_min` is specified then no curve fitting will be
     #   performed unless the maximum value in `day` is at least
     #   `peak_min`.
@@ -22,7 +24,8 @@ def _conditional_fit(day, minutes, fitfunc, freq, default=0.0, min_hours=0.0,
     # Parameters
     # ----------
     # day : Series
-    #     y-values to which `fitfunc` will be applied.
+    #     y-values to which `fitfunc` will be applied. Must not
+    #     contain NaN.
     # minutes : Series
     #     x-values for curve fitting. The index for `x` must be a
     #     superset of the index for `day`.
@@ -30,13 +33,12 @@ def _conditional_fit(day, minutes, fitfunc, freq, default=0.0, min_hours=0.0,
     #     Function to perform curve fit. Must accept two parameters,
     #     the x-values and y-values, and return the :math:`r^2`
     #     of the curve fit.
-    # freq : str
-    #     Timestamp spacing for data in `day`.
     # default : float, default 0.0
     #     Value to be returned if the conditions above are not
     #     satisfied and `fitfunc` is not applied.
-    # min_hours : float, default 0.0
-    #     Minimum hours in `day` with data for curve fitting to be performed.
+    # min_samples : int, default 1
+    #     Minimum number of values in `day` for curve fitting to be
+    #     performed.
     # peak_min : float or None, default None
     #     Maximum value in `day` must be at least `peak_min` for curve
     #     fitting to be performed.
@@ -48,21 +50,182 @@ def _conditional_fit(day, minutes, fitfunc, freq, default=0.0, min_hours=0.0,
     #     if fit was not performed.
     high_enough = True
     if peak_min is not None:
-        high_enough = day.max() > peak_min
-    if (_hours(day, freq) > min_hours) and high_enough:
+        high_enough = day.to_numpy().max() > peak_min
+    if (len(day) >= min_samples) and high_enough:
         return fitfunc(minutes[day.index], day)
     return default
 
 
+def _quadratic_r2_by_day(data, minutes, days, mask, default=0.0,
+                         min_samples=1, peak_min=None):
+    # Return the :math:`r^2` of a quadratic fit to each day of data.
+    #
+    # Equivalent to applying `_conditional_fit` with
+    # `fitfunc=_fit.quadratic_r2` to each day of `data[mask]`, but all
+    # days are fit at once. The data is placed on a grid with one row
+    # per day and one column per time of day, then the normal
+    # equations for every day are solved in a single batched call.
+    # Cells without a sample are excluded from the fit by giving them
+    # zero weight. The normal equations matrix for a day depends only
+    # on which cells have data, so it is computed and inverted once
+    # for each distinct pattern of missing samples rather than once
+    # per day. This leaves a single matrix-vector product per day.
+    #
+    # `minutes`, `days`, and `mask` are applied to `data` by position
+    # rather than by label, so they must all have the same length as
+    # `data`.
+    #
+    # Parameters
+    # ----------
+    # data : Series
+    #     Timezone localized series of y-values.
+    # minutes : array_like
+    #     x-values for curve fitting.
+    # days : array_like
+    #     Day number of each value (see `_days_and_minutes`).
+    # mask : array_like
+    #     Boolean mask with True for values to include in the fits.
+    #     Must be False wherever `data` is NaN.
+    # default : float, default 0.0
+    #     Value returned for days that do not satisfy the conditions
+    #     for fitting (see `_conditional_fit`) and for days where every
+    #     value is the same.
+    # min_samples : int, default 1
+    #     Minimum number of values in a day for curve fitting to be
+    #     performed.
+    # peak_min : float or None, default None
+    #     Maximum value in a day must be at least `peak_min` for curve
+    #     fitting to be performed.
+    #
+    # Returns
+    # -------
+    # Series
+    #     The :math:`r^2` of the quadratic fit for each day, indexed by
+    #     day number.
+    keep = np.asarray(mask, dtype=bool)
+    values = data.to_numpy(dtype=float)[keep]
+    day_numbers, row = np.unique(days[keep], return_inverse=True)
+    times, time = np.unique(minutes[keep], return_inverse=True)
+    # Every sample gets its own cell so that no samples are averaged
+    # together. Columns are keyed on the exact time of day and on how
+    # many times that time has already occurred on the same day, which
+    # keeps both samples from the repeated hour when DST ends.
+    repeat = pd.Series(time).groupby([row, time]).cumcount().to_numpy()
+    repeats = repeat.max() + 1 if len(repeat) else 1
+    columns, column = np.unique(time * repeats + repeat, return_inverse=True)
+    # Days where every value is the same are never fit. This is
+    # checked on the values themselves because rounding error in the
+    # sums of squares would otherwise make r^2 on these days arbitrary.
+    highest = np.full(len(day_numbers), -np.inf)
+    lowest = np.full(len(day_numbers), np.inf)
+    np.maximum.at(highest, row, values)
+    np.minimum.at(lowest, row, values)
+    count = np.bincount(row, minlength=len(day_numbers))
+    # A quadratic passes exactly through any one or two points, so days
+    # with fewer than three values are treated as not having enough
+    # data, even if `min_samples` is smaller.
+    fit = (count >= max(min_samples, 3)) & (highest > lowest)
+    if peak_min is not None:
+        fit &= highest > peak_min
+    # Each day is centered on its mean and scaled by its range in
+    # double precision. r^2 does not change, but the values to fit are
+    # then of order one whatever the magnitude or spread of the data,
+    # and the total sum of squares of every fit day is at least 1/2.
+    spread = np.where(fit, highest - lowest, 1.0)
+    mean = np.bincount(row, values, minlength=len(day_numbers)) / count
+    values = (values - mean[row]) / spread[row]
+    ss_tot = np.bincount(row, values**2, minlength=len(day_numbers))
+    # The fits are computed in single precision to halve the memory
+    # traffic over the grid. After scaling this is ample precision for
+    # comparing r^2 against thresholds, and the normal equations are
+    # well conditioned (see below).
+    y = np.zeros((len(day_numbers), len(columns)), dtype=np.float32)
+    valid = np.zeros(y.shape, dtype=bool)
+    y[row, column] = values
+    valid[row, column] = True
+    # Centering and scaling the minutes onto [-1, 1] keeps the normal
+    # equations well conditioned. Only r^2 is returned, so the
+    # coefficients never need to be transformed back.
+    x = (times[columns // repeats] - 720) / 720
+    powers = np.vander(x, 5, increasing=True).astype(np.float32)
+    x = powers[:, :3]
+    r2 = np.full(len(day_numbers), default, dtype=float)
+    if not fit.any():
+        return pd.Series(r2, index=day_numbers)
+    y, valid = y[fit], valid[fit]
+    # Pack each day's mask into bytes so distinct patterns can be found
+    # with a one-dimensional unique rather than a row-wise comparison.
+    packed = np.packbits(valid, axis=1)
+    _, first, pattern = np.unique(
+        packed.view(np.dtype((np.void, packed.shape[1]))).ravel(),
+        return_index=True,
+        return_inverse=True
+    )
+    patterns = valid[first]
+    # The normal equations matrix is a Hankel matrix of the sums of
+    # x**0 through x**4 over the samples in each pattern.
+    order = np.arange(3)
+    gram = (patterns.astype(np.float32) @ powers)[
+        :, order[:, np.newaxis] + order
+    ]
+    coefficients = np.einsum(
+        'dij,dj->di', np.linalg.inv(gram)[pattern], y @ x
+    )
+    residuals = np.where(valid, y - coefficients @ x.T, 0.0)
+    ss_res = np.sum(residuals**2, axis=1, dtype=float)
+    r2[fit] = 1 - ss_res / ss_tot[fit]
+    return pd.Series(r2, index=day_numbers)
+
+
+def _days_and_minutes(index):
+    # Return the local calendar day of each timestamp in `index` as
+    # the number of days since 1970-01-01, and the time since local
+    # midnight for each timestamp in (fractional) minutes.
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    times = index.to_numpy()
+    days = times.astype('datetime64[D]')
+    minutes = (times - days) / np.timedelta64(1, 'm')
+    return days.astype(np.int64), minutes
+
+
+def _align_mask(mask, index):
+    # Return boolean `mask` as an array aligned with `index`. A Series
+    # is aligned by label, with timestamps in `index` that are not in
+    # `mask` treated as False. Any other array is used by position.
+    if not isinstance(mask, pd.Series):
+        return np.asarray(mask, dtype=bool)
+    return mask.reindex(index, fill_value=False).to_numpy(dtype=bool)
+
+
+def _expand_days(flags, days, index):
+    # Return a boolean Series with `index` that is True on the days
+    # where `flags` is True. `flags` is indexed by day number and
+    # `days` holds the day number of each timestamp in `index`.
+    first = days.min()
+    by_day = np.zeros(days.max() - first + 1, dtype=bool)
+    by_day[flags.index.to_numpy() - first] = flags.to_numpy()
+    return pd.Series(by_day[days - first], index=index)
+
+
 def _freqstr_to_hours(freq):
     # Convert pandas freqstr to hours (as a float)
-    return util.freq_to_timedelta(freq).seconds / 3600
+    return util.freq_to_timedelta(freq).total_seconds() / 3600
+
 
+def _min_samples(min_hours, hours_per_sample):
+    # Return the minimum number of values spaced `hours_per_sample`
+    # apart that span more than `min_hours`.
+    return int(np.floor(min_hours / hours_per_sample)) + 1
 
-def _hours(data, freq):
-    # Return the number of hours in `data` with timestamp
-    # spacing given by `freq`.
-    return data.count() * _freqstr_to_hours(freq)
+
+def _fit_inputs(index, min_hours):
+    # Return the day number and minute since midnight for each
+    # timestamp in `index` (see `_days_and_minutes`), and the minimum
+    # number of samples a day needs for a fit to be attempted.
+    days, minutes = _days_and_minutes(index)
+    hours_per_sample = _freqstr_to_hours(pd.infer_freq(index))
+    return days, minutes, _min_samples(min_hours, hours_per_sample)
 
 
 def tracking_nrel(power_or_irradiance, daytime, r2_min=0.915,
@@ -141,35 +304,49 @@ def tracking_nrel(power_or_irradiance, daytime, r2_min=0.915,
     project. Copyright (c) 2020 Alliance for Sustainable Energy, LLC.
 
     """
-    if quadratic_mask is None:
-        quadratic_mask = daytime
-    freq = pd.infer_freq(power_or_irradiance.index)
-    minutes = pd.Series(
-        power_or_irradiance.index.hour * 60 + power_or_irradiance.index.minute,
-        index=power_or_irradiance.index
+    days, minutes, min_samples = _fit_inputs(
+        power_or_irradiance.index, min_hours
     )
-    daily_data = _group.by_day(power_or_irradiance[daytime])
-    tracking_days = daily_data.apply(
-        _conditional_fit,
-        fitfunc=_fit.quartic_restricted_r2,
+    present = power_or_irradiance.notna().to_numpy()
+    keep = _align_mask(daytime, power_or_irradiance.index) & present
+    if quadratic_mask is None:
+        quadratic_keep = keep
+    else:
+        quadratic_keep = (
+            _align_mask(quadratic_mask, power_or_irradiance.index)
+            & present
+        )
+    fixed_days = _quadratic_r2_by_day(
+        power_or_irradiance,
         minutes=minutes,
-        freq=freq,
-        min_hours=min_hours,
+        days=days,
+        mask=quadratic_keep,
+        min_samples=min_samples,
         peak_min=peak_min
     )
-    fixed_days = _group.by_day(power_or_irradiance[quadratic_mask]).apply(
+    # Days where the quadratic fit is too good are never marked True,
+    # so the (much more expensive) quartic is only fit on other days.
+    fixed = fixed_days >= r2_fixed_max
+    if fixed.any():
+        keep = keep & ~_expand_days(
+            fixed, days, power_or_irradiance.index
+        ).to_numpy()
+    tracking_days = power_or_irradiance[keep].groupby(
+        days[keep], sort=False
+    ).agg(functools.partial(
         _conditional_fit,
-        fitfunc=_fit.quadratic_r2,
-        minutes=minutes,
-        freq=freq,
-        min_hours=min_hours,
+        fitfunc=_fit.quartic_restricted_r2,
+        minutes=pd.Series(minutes, index=power_or_irradiance.index),
+        min_samples=min_samples,
         peak_min=peak_min
-    )
-    return (
+    ))
+    fixed_days = fixed_days.reindex(tracking_days.index, fill_value=0.0)
+    tracking = (
         (tracking_days > r2_min)
         & (tracking_days > fixed_days)
         & (fixed_days < r2_fixed_max)
-    ).reindex(power_or_irradiance.index, method='pad', fill_value=False)
+    )
+    return _expand_days(tracking, days, power_or_irradiance.index)
 
 
 def fixed_nrel(power_or_irradiance, daytime, r2_min=0.94,
@@ -214,22 +391,18 @@ def fixed_nrel(power_or_irradiance, daytime, r2_min=0.94,
     project. Copyright (c) 2020 Alliance for Sustainable Energy, LLC.
 
     """
-    freq = pd.infer_freq(power_or_irradiance.index)
-    daily_data = _group.by_day(
-        power_or_irradiance[daytime]
-    )
-    minutes = pd.Series(
-        power_or_irradiance.index.hour * 60 + power_or_irradiance.index.minute,
-        index=power_or_irradiance.index
+    days, minutes, min_samples = _fit_inputs(
+        power_or_irradiance.index, min_hours
     )
-    fixed_days = daily_data.apply(
-        _conditional_fit,
-        fitfunc=_fit.quadratic_r2,
+    fixed_days = _quadratic_r2_by_day(
+        power_or_irradiance,
         minutes=minutes,
-        freq=freq,
-        min_hours=min_hours,
+        days=days,
+        mask=(_align_mask(daytime, power_or_irradiance.index)
+              & power_or_irradiance.notna().to_numpy()),
+        min_samples=min_samples,
         peak_min=peak_min
     )
-    return (
-        fixed_days > r2_min
-    ).reindex(power_or_irradiance.index, method='pad', fill_value=False)
+    return _expand_days(
+        fixed_days > r2_min, days, power_or_irradiance.index
+    )
@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 from pandas.testing import assert_series_equal
 import pandas as pd
 from pvlib import pvsystem, modelchain, irradiance
@@ -32,6 +33,25 @@ def test_perturbed_ghi_fixed(clearsky, solarposition):
     )
 
 
+def test_constant_day_not_fixed(albuquerque):
+    """A day where the data is constant is not identified as fixed."""
+    index = pd.date_range(
+        start='06/01/2020',
+        end='06/03/2020 23:59',
+        freq='1min',
+        tz=albuquerque.tz
+    )
+    ghi = albuquerque.get_clearsky(index, model='simplified_solis')['ghi']
+    constant = index.day == 2
+    ghi[constant] = 733.857
+    daytime = albuquerque.get_solarposition(index)['zenith'] < 87
+    assert_series_equal(
+        orientation.fixed_nrel(ghi, daytime),
+        pd.Series(~constant, index),
+        check_names=False
+    )
+
+
 def test_ghi_not_tracking(clearsky, solarposition):
     """If we pass GHI measurements and tracking=True then no days are sunny."""
     assert (~orientation.tracking_nrel(
@@ -85,6 +105,88 @@ def test_power_tracking_perturbed(power_tracking, solarposition):
     )
 
 
+def test_masks_aligned_by_label(power_tracking, solarposition):
+    """`daytime` and `quadratic_mask` are matched to the data by
+    timestamp, not by position."""
+    daytime = solarposition['zenith'] < 87
+    expected = orientation.tracking_nrel(power_tracking, daytime)
+    superset = daytime.reindex(
+        daytime.index.union(daytime.index + pd.Timedelta(days=3)),
+        fill_value=True
+    )
+    shuffled = daytime.sample(frac=1, random_state=0)
+    for mask in (superset, shuffled):
+        assert_series_equal(
+            orientation.tracking_nrel(power_tracking, mask),
+            expected
+        )
+        assert_series_equal(
+            orientation.tracking_nrel(
+                power_tracking, daytime, quadratic_mask=mask
+            ),
+            expected
+        )
+        assert_series_equal(
+            orientation.fixed_nrel(power_tracking, mask),
+            orientation.fixed_nrel(power_tracking, daytime)
+        )
+
+
+def test_masks_as_arrays(power_tracking, solarposition):
+    """`daytime` and `quadratic_mask` given as boolean arrays are
+    matched to the data by position."""
+    daytime = solarposition['zenith'] < 87
+    assert_series_equal(
+        orientation.tracking_nrel(
+            power_tracking,
+            daytime.to_numpy(),
+            quadratic_mask=daytime.to_numpy()
+        ),
+        orientation.tracking_nrel(power_tracking, daytime)
+    )
+    assert_series_equal(
+        orientation.fixed_nrel(power_tracking, daytime.to_numpy()),
+        orientation.fixed_nrel(power_tracking, daytime)
+    )
+
+
+@pytest.fixture(scope='module')
+def ten_seconds(albuquerque):
+    """Two days with 10 second timestamp spacing in `albuquerque`."""
+    return pd.date_range(
+        start='03/01/2020',
+        end='03/02/2020 23:59:50',
+        freq='10s',
+        tz=albuquerque.tz
+    )
+
+
+def test_clearsky_ghi_fixed_sub_minute(albuquerque, ten_seconds):
+    """Data with more than one value per minute is identified as fixed."""
+    clearsky = albuquerque.get_clearsky(ten_seconds)
+    solarposition = albuquerque.get_solarposition(ten_seconds)
+    assert orientation.fixed_nrel(
+        clearsky['ghi'],
+        solarposition['zenith'] < 87
+    ).all()
+
+
+def test_power_tracking_sub_minute(albuquerque, ten_seconds,
+                                   array_parameters, system_parameters):
+    """Simulated tracker power with 10 second spacing is identified as
+    tracking."""
+    clearsky = albuquerque.get_clearsky(ten_seconds)
+    solarposition = albuquerque.get_solarposition(ten_seconds)
+    array = pvsystem.Array(pvsystem.SingleAxisTrackerMount(),
+                           **array_parameters)
+    system = pvsystem.PVSystem(arrays=[array], **system_parameters)
+    mc = modelchain.ModelChain(system, albuquerque)
+    mc.run_model(clearsky)
+    daytime = solarposition['zenith'] < 87
+    assert orientation.tracking_nrel(mc.results.ac, daytime).all()
+    assert not orientation.tracking_nrel(clearsky['ghi'], daytime).any()
+
+
 def test_stuck_tracker_profile(solarposition, clearsky):
     """Test POA irradiance at a awkward orientation (high tilt and
     oriented West)."""
@@ -111,3 +213,118 @@ def test_frequency_to_hours():
     assert orientation._freqstr_to_hours('h') == 1.0
     assert orientation._freqstr_to_hours('15min') == 0.25
     assert orientation._freqstr_to_hours('2h') == 2.0
+    assert orientation._freqstr_to_hours('36h') == 36.0
+
+
+def _polyfit_r2_by_day(data, mask):
+    # r^2 of a quadratic fit to each day, computed independently of
+    # pvanalytics with np.polyfit
+    data = data[mask]
+    r2 = {}
+    for day, values in data.groupby(data.index.date):
+        x = (values.index - values.index.normalize()) / pd.Timedelta('1min')
+        y = values.to_numpy()
+        if np.ptp(y) == 0:
+            r2[day] = 0.0
+            continue
+        residuals = y - np.polyval(np.polyfit(x, y, 2), x)
+        r2[day] = 1 - np.sum(residuals**2) / np.sum((y - np.mean(y))**2)
+    return pd.Series(r2)
+
+
+def _assert_quadratic_r2_by_day(data, mask):
+    days, minutes = orientation._days_and_minutes(data.index)
+    r2 = orientation._quadratic_r2_by_day(data, minutes, days, mask)
+    np.testing.assert_allclose(
+        r2.to_numpy(),
+        _polyfit_r2_by_day(data, mask).to_numpy(),
+        atol=1e-6
+    )
+
+
+def test_quadratic_r2_by_day(clearsky, solarposition):
+    """Batched quadratic fit matches fitting each day individually."""
+    ghi = clearsky['ghi'].copy()
+    ghi.iloc[30:35] = ghi.iloc[30:35] * 0.5
+    _assert_quadratic_r2_by_day(ghi, solarposition['zenith'] < 87)
+
+
+def test_quadratic_r2_by_day_gaps(clearsky, solarposition):
+    """Days with different missing timestamps are each fit using only
+    their own samples."""
+    ghi = clearsky['ghi'].copy()
+    ghi.iloc[30:35] = ghi.iloc[30:35] * 0.5
+    daytime = solarposition['zenith'] < 87
+    daytime.iloc[[12, 13, 38, 60, 61, 62]] = False
+    _assert_quadratic_r2_by_day(ghi, daytime)
+
+
+def test_quadratic_r2_by_day_sub_minute(albuquerque, ten_seconds):
+    """Every sample is used when there is more than one per minute."""
+    ghi = albuquerque.get_clearsky(ten_seconds)['ghi']
+    ghi = ghi * (1 + 0.2 * np.sin(np.arange(len(ghi)) / 7))
+    daytime = albuquerque.get_solarposition(ten_seconds)['zenith'] < 87
+    _assert_quadratic_r2_by_day(ghi, daytime)
+
+
+def test_quadratic_r2_by_day_constant(albuquerque):
+    """Constant days have r^2 of 0 and nearly constant days are fit as
+    accurately as any other day."""
+    index = pd.date_range(
+        start='06/01/2020',
+        end='06/04/2020 23:59',
+        freq='1min',
+        tz=albuquerque.tz
+    )
+    ghi = albuquerque.get_clearsky(index, model='simplified_solis')['ghi']
+    noise = np.random.default_rng(0).normal(size=len(index))
+    ghi[index.day == 2] = 733.857
+    ghi[index.day == 3] = 733.857 + 1e-3 * ghi[index.day == 3]
+    ghi[index.day == 4] = 733.857 + 1e-3 * noise[index.day == 4]
+    daytime = albuquerque.get_solarposition(index)['zenith'] < 87
+    _assert_quadratic_r2_by_day(ghi, daytime)
+
+
+def test_min_samples():
+    assert orientation._min_samples(5, 1.0) == 6
+    assert orientation._min_samples(5, 0.25) == 21
+    assert orientation._min_samples(5, 1 / 60) == 301
+    assert orientation._min_samples(0, 0.25) == 1
+
+
+def test_power_tracking_missing_values(power_tracking, solarposition):
+    """Missing values are excluded from the fits."""
+    power_tracking.iloc[12:14] = np.nan
+    assert orientation.tracking_nrel(
+        power_tracking,
+        solarposition['zenith'] < 87
+    ).all()
+
+
+def test_days_and_minutes():
+    """Days and minutes follow the local clock, including across DST."""
+    index = pd.date_range(
+        '2020-03-07 22:00', '2020-03-09 02:00', freq='15min',
+        tz='America/Denver'
+    )
+    days, minutes = orientation._days_and_minutes(index)
+    expected = pd.to_datetime(index.date).to_numpy().astype('datetime64[D]')
+    np.testing.assert_array_equal(days, expected.astype(np.int64))
+    np.testing.assert_array_equal(minutes, index.hour * 60 + index.minute)
+    naive_days, naive_minutes = orientation._days_and_minutes(
+        index.tz_localize(None)
+    )
+    np.testing.assert_array_equal(naive_days, days)
+    np.testing.assert_array_equal(naive_minutes, minutes)
+
+
+def test_tracking_skips_quartic_on_fixed_days(clearsky, solarposition,
+                                              monkeypatch):
+    """The quartic is not fit on days where the quadratic fit is too good
+    for the day to be marked as tracking."""
+    def _fail(x, y):
+        raise AssertionError('quartic fit should have been skipped')
+    monkeypatch.setattr(orientation._fit, 'quartic_restricted_r2', _fail)
+    assert not orientation.tracking_nrel(
+        clearsky['ghi'], solarposition['zenith'] < 87
+    ).any()
@@ -0,0 +1,55 @@
+"""Tests for curve fitting functions."""
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats
+from pvanalytics.util import _fit
+
+
+def _polyfit_r2(x, y):
+    # r^2 of a quadratic fit computed with polyfit and linregress
+    coefficients = np.polynomial.polynomial.polyfit(x, y, 2)
+    fitted = np.polynomial.polynomial.polyval(x, coefficients)
+    return scipy.stats.linregress(fitted, y).rvalue**2
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_quadratic_r2_matches_polyfit(seed):
+    """quadratic_r2 matches a polyfit/linregress reference on noisy
+    daily profiles."""
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.choice(np.arange(300, 1140), 200, replace=False))
+    y = pd.Series(
+        1000 * np.sin(np.pi * (x - 300) / 840) + rng.normal(0, 100, 200)
+    )
+    assert _fit.quadratic_r2(x, y) == pytest.approx(
+        _polyfit_r2(x, y), abs=1e-12
+    )
+
+
+def test_quadratic_r2_perfect_fit(quadratic):
+    """A quadratic is fit exactly."""
+    assert _fit.quadratic_r2(quadratic.index, quadratic) == pytest.approx(
+        1.0
+    )
+
+
+def test_quadratic_r2_constant():
+    """Constant data has r^2 of 0."""
+    assert _fit.quadratic_r2(np.arange(10), pd.Series(5.0, range(10))) == 0
+
+
+@pytest.mark.filterwarnings('ignore:The fit may be poorly conditioned')
+def test_quadratic_r2_rank_deficient():
+    """Fewer than three distinct x-values fall back to least squares."""
+    x = np.array([0, 0, 1, 1])
+    y = pd.Series([1., 2, 3, 4])
+    assert _fit.quadratic_r2(x, y) == pytest.approx(_polyfit_r2(x, y))
+    assert _fit.quadratic_r2(x, y) == pytest.approx(0.8)
+
+
+def test_quadratic_r2_single_x():
+    """All x-values equal gives r^2 of 0 rather than raising."""
+    assert _fit.quadratic_r2(
+        np.array([1, 1, 1, 1]), pd.Series([1., 2, 3, 4])
+    ) == pytest.approx(0.0)
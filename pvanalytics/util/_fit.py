@@ -1,5 +1,6 @@
 """Internal module for curve fitting functions."""
 import numpy as np
+import scipy.linalg
 import scipy.optimize
 
 
@@ -9,6 +10,21 @@ def _quadratic(xs, ys):
     return np.poly1d(coefficients)
 
 
+def _quartic(x, a, b, c, e):
+    # quartic function of `x`, symmetric about `e`
+    return a * (x - e)**4 + b * (x - e)**2 + c
+
+
+def _quartic_jacobian(x, a, b, c, e):
+    # Partial derivatives of `_quartic` with respect to a, b, c, and
+    # e. Passing these to curve_fit avoids estimating the Jacobian by
+    # finite differences on every iteration.
+    d = x - e
+    return np.column_stack(
+        (d**4, d**2, np.ones_like(d), -4 * a * d**3 - 2 * b * d)
+    )
+
+
 def quadratic_vertex(x, y):
     """Fit a quadratic to the x, y data and return the x-value of the vertex.
 
@@ -64,11 +80,23 @@ def quadratic_r2(x, y):
     """
     if np.std(y) == 0:
         return 0
-    quadratic = _quadratic(x, y)
-    _, _, correlation, _, _ = scipy.stats.linregress(
-        quadratic(x), y
-    )
-    return correlation**2
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(np.unique(x)) < 3:
+        # The normal equations are singular, so fall back to the
+        # minimum-norm least squares solution.
+        design = np.vander(x, 3)
+        coefficients, *_ = np.linalg.lstsq(design, y, rcond=None)
+    else:
+        # Center and scale x so the normal equations are well
+        # conditioned enough to be solved by Cholesky factorization.
+        half_range = (x.max() - x.min()) / 2
+        design = np.vander((x - x.min()) / half_range - 1, 3)
+        coefficients = scipy.linalg.cho_solve(
+            scipy.linalg.cho_factor(design.T @ design), design.T @ y
+        )
+    residuals = y - design @ coefficients
+    return 1 - np.sum(residuals**2) / np.sum((y - np.mean(y))**2)
 
 
 def quartic_restricted_r2(x, y, noon=720):
@@ -116,12 +144,11 @@ def quartic_restricted_r2(x, y, noon=720):
     Alliance for Sustainable Energy, LLC.
 
     """
-    def _quartic(x, a, b, c, e):
-        return a * (x - e)**4 + b * (x - e)**2 + c
     median = y.median()
     params, _ = scipy.optimize.curve_fit(
         _quartic,
         x, y,
+        jac=_quartic_jacobian,
         bounds=((-1e-05, 0, median * 0.85, noon - 70),
                 (-1e-10, median * 3e-05, median * 1.15, noon + 70))
     )